@@ -0,0 +1,131 @@
+# analytics.py
+# =============================================================================
+# Tabel ringkasan analitik yang diperbarui inkremental di jalur simpan.
+# Kunci: (hari, audience, segment) -> jumlah sesi, total giliran, jumlah opener.
+# Dashboard hanya membaca tabel ini (tanpa parse messages_json).
+#
+#   python analytics.py rebuild [--db telesales_history.sqlite]
+# =============================================================================
+import sys
+import json
+import argparse
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# (created_at, audience, segment, turns, openers) dari tabel convo
+ConvoStats = Tuple[str, str, str, int, int]
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_summary(
+            day TEXT NOT NULL,
+            audience TEXT NOT NULL,
+            segment TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            turns INTEGER NOT NULL DEFAULT 0,
+            openers INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(day, audience, segment)
+        )
+    """)
+
+
+# Giliran = pesan trainee (role user) yang terlihat
+def count_turns(msgs: Iterable[Any]) -> int:
+    return sum(1 for m in msgs if m.role == "user" and not m.internal)
+
+
+def _apply(conn: sqlite3.Connection, stats: ConvoStats, sign: int) -> None:
+    created_at, audience, segment, turns, openers = stats
+    key = ((created_at or "")[:10], audience or "", segment or "")
+    conn.execute(
+        "INSERT INTO daily_summary(day,audience,segment,sessions,turns,openers) VALUES(?,?,?,?,?,?) "
+        "ON CONFLICT(day,audience,segment) DO UPDATE SET "
+        "sessions=sessions+excluded.sessions,turns=turns+excluded.turns,openers=openers+excluded.openers",
+        (*key, sign, sign * int(turns or 0), sign * int(openers or 0)),
+    )
+    if sign < 0:
+        conn.execute(
+            "DELETE FROM daily_summary WHERE day=? AND audience=? AND segment=? AND sessions<=0", key
+        )
+
+
+# Dipanggil di dalam transaksi simpan yang sama (caller yang commit)
+def on_upsert(conn: sqlite3.Connection, old: Optional[ConvoStats], new: ConvoStats) -> None:
+    if old is not None:
+        _apply(conn, old, -1)
+    _apply(conn, new, +1)
+
+
+def on_delete(conn: sqlite3.Connection, old: Optional[ConvoStats]) -> None:
+    if old is not None:
+        _apply(conn, old, -1)
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    # Hitung ulang convo.turns dari messages_json (termasuk prefix fork), lalu isi ulang
+    # daily_summary. convo.openers dipertahankan: pesan opener internal tidak disimpan.
+    from storage import load_messages
+
+    rows = conn.execute("SELECT id FROM convo").fetchall()
+    try:
+        for (convo_id,) in rows:
+            try:
+                turns = count_turns(load_messages(conn, convo_id))
+            except ValueError:
+                turns = 0
+            conn.execute("UPDATE convo SET turns=? WHERE id=?", (turns, convo_id))
+        conn.execute("DELETE FROM daily_summary")
+        conn.execute("""
+            INSERT INTO daily_summary(day,audience,segment,sessions,turns,openers)
+            SELECT substr(created_at,1,10), COALESCE(audience,''), COALESCE(segment,''),
+                   COUNT(*), SUM(turns), SUM(openers)
+            FROM convo GROUP BY 1,2,3
+        """)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+def read_summary(conn: sqlite3.Connection, since_day: Optional[str] = None) -> List[Dict[str, Any]]:
+    q = "SELECT day,audience,segment,sessions,turns,openers FROM daily_summary"
+    args: Tuple[str, ...] = ()
+    if since_day:
+        q += " WHERE day>=?"
+        args = (since_day,)
+    q += " ORDER BY day DESC, audience, segment"
+    return [
+        {
+            "day": r[0],
+            "audience": r[1],
+            "segment": r[2],
+            "sessions": r[3],
+            "turns": r[4],
+            "avg_turns": round(r[4] / r[3], 2) if r[3] else 0.0,
+            "openers": r[5],
+        }
+        for r in conn.execute(q, args)
+    ]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from storage import DB_PATH, open_db
+
+    ap = argparse.ArgumentParser(description="Kelola tabel ringkasan analitik.")
+    ap.add_argument("command", choices=["rebuild", "show"])
+    ap.add_argument("--db", default=str(DB_PATH))
+    args = ap.parse_args(argv)
+    conn = open_db(args.db)
+    if args.command == "rebuild":
+        n = rebuild(conn)
+        print(f"daily_summary dibangun ulang dari {n} percakapan")
+    else:
+        for row in read_summary(conn):
+            print(json.dumps(row, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+# async_core.py
+# =============================================================================
+# Inti generasi berbasis asyncio untuk semua panggilan model dari app.py.
+# - Satu event loop di satu thread latar per replika (jumlah thread tetap,
+#   berapa pun sesi yang sedang menunggu model)
+# - Deadline per panggilan + batas jeda antar-chunk (stream macet tidak
+#   memblokir script Streamlit selamanya)
+# - Pembatalan kooperatif per sesi (cancel_session) dan saat konsumen berhenti
+#   membaca stream (mis. rerun Streamlit menutup generator)
+# - Semaphore konkurensi + rate limiter bersama (RateLimiter.call_async)
+# - Jembatan sinkron tipis: stream()/generate() untuk script Streamlit
+#
+#   python async_core.py [--sessions 50 200 1000]   # stress test terhadap stub lokal
+# =============================================================================
+import sys
+import time
+import queue
+import asyncio
+import inspect
+import argparse
+import threading
+import concurrent.futures
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set
+
+from ratelimit import env_float
+
+# factory/call boleh mengembalikan awaitable (client.aio) atau langsung objeknya
+AsyncFactory = Callable[[], Any]
+
+
+class GenerationTimeout(TimeoutError):
+    pass
+
+
+class GenerationCancelled(RuntimeError):
+    pass
+
+
+async def _resolve(value: Any) -> Any:
+    return await value if inspect.isawaitable(value) else value
+
+
+_CHUNK, _END, _ERR = 0, 1, 2
+
+
+class GenerationCore:
+    def __init__(
+        self,
+        limiter: Any = None,
+        max_concurrency: int = 16,
+        timeout_s: float = 60.0,
+        stall_s: float = 20.0,
+    ):
+        self.limiter = limiter
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout_s = timeout_s
+        self.stall_s = stall_s
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="genai-async", daemon=True)
+        self._thread.start()
+        self._sem = self._run_sync(self._make_semaphore())
+        # session_id -> task aktif; hanya disentuh dari thread event loop
+        self._tasks: Dict[str, Set["asyncio.Task[Any]"]] = {}
+        self._lock = threading.Lock()
+        self._active = 0  # memegang slot semaphore
+        self._queued = 0  # menunggu slot semaphore
+        self._peak_active = 0
+        self._peak_queued = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._cancelled = 0
+        self._errors = 0
+
+    async def _make_semaphore(self) -> asyncio.Semaphore:
+        return asyncio.Semaphore(self.max_concurrency)  # dibuat di loop milik core
+
+    def _run_sync(self, coro: Awaitable[Any]) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _count(self, attr: str, delta: int = 1) -> None:
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + delta)
+            self._peak_active = max(self._peak_active, self._active)
+            self._peak_queued = max(self._peak_queued, self._queued)
+
+    def _register(self, session_id: str) -> "asyncio.Task[Any]":
+        task = asyncio.current_task()
+        assert task is not None
+        self._tasks.setdefault(session_id, set()).add(task)
+        return task
+
+    def _unregister(self, session_id: str, task: "asyncio.Task[Any]") -> None:
+        tasks = self._tasks.get(session_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[session_id]
+
+    # Tunggu satu langkah dengan sisa deadline dan (opsional) batas jeda antar-chunk
+    async def _step(self, aw: Awaitable[Any], deadline: float, stall: bool = True) -> Any:
+        remaining = deadline - self._loop.time()
+        limit = min(remaining, self.stall_s) if stall else remaining
+        if limit <= 0:
+            if inspect.iscoroutine(aw):
+                aw.close()
+            raise GenerationTimeout("Deadline panggilan model terlewati.")
+        try:
+            return await asyncio.wait_for(aw, limit)
+        except asyncio.TimeoutError:
+            reason = "jeda antar-chunk" if stall and limit < remaining else "deadline"
+            raise GenerationTimeout(f"Model tidak merespons ({reason} {limit:.1f} s).") from None
+
+    # Slot semaphore dipegang sepanjang panggilan (untuk stream: sampai stream selesai)
+    async def _acquire_slot(self, deadline: float) -> None:
+        if self._sem.locked():  # hanya yang benar-benar menunggu dihitung antre
+            self._count("_queued")
+            try:
+                await self._step(self._sem.acquire(), deadline, stall=False)
+            finally:
+                self._count("_queued", -1)
+        else:
+            await self._sem.acquire()
+        self._count("_active")
+
+    def _release_slot(self) -> None:
+        self._sem.release()
+        self._count("_active", -1)
+
+    async def _limited(self, session_id: str, deadline: float, body: Callable[[], Awaitable[Any]]) -> Any:
+        # Rate limiter -> body, di dalam deadline yang sama
+        if self.limiter is None:
+            return await self._step(body(), deadline, stall=False)
+        remaining = deadline - self._loop.time()
+        return await self._step(self.limiter.call_async(session_id, body, timeout=remaining), deadline, stall=False)
+
+    # === Async API =========================================================
+    async def agenerate(self, session_id: str, call: AsyncFactory, timeout_s: Optional[float] = None) -> Any:
+        deadline = self._loop.time() + (self.timeout_s if timeout_s is None else timeout_s)
+        task = self._register(session_id)
+        slot = False
+        try:
+            await self._acquire_slot(deadline)
+            slot = True
+            result = await self._limited(session_id, deadline, lambda: _resolve(call()))
+            self._count("_completed")
+            return result
+        except GenerationTimeout:
+            self._count("_timeouts")
+            raise
+        except asyncio.CancelledError:
+            self._count("_cancelled")
+            raise
+        except Exception:
+            self._count("_errors")
+            raise
+        finally:
+            if slot:
+                self._release_slot()
+            self._unregister(session_id, task)
+
+    async def astream(self, session_id: str, factory: AsyncFactory, timeout_s: Optional[float] = None) -> AsyncIterator[Any]:
+        deadline = self._loop.time() + (self.timeout_s if timeout_s is None else timeout_s)
+        task = self._register(session_id)
+        slot = False
+        it: Any = None
+
+        # Chunk pertama ditarik di dalam limiter agar 429 saat membuka stream ikut di-backoff
+        async def _open() -> Any:
+            nonlocal it
+            it = (await _resolve(factory())).__aiter__()
+            try:
+                return (True, await it.__anext__())
+            except StopAsyncIteration:
+                return (False, None)
+
+        try:
+            await self._acquire_slot(deadline)
+            slot = True
+            has_first, first = await self._limited(session_id, deadline, _open)
+            if has_first:
+                yield first
+                while True:
+                    try:
+                        chunk = await self._step(it.__anext__(), deadline)
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+            self._count("_completed")
+        except GenerationTimeout:
+            self._count("_timeouts")
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            self._count("_cancelled")
+            raise
+        except Exception:
+            self._count("_errors")
+            raise
+        finally:
+            self._unregister(session_id, task)
+            aclose = getattr(it, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()  # tutup koneksi HTTP stream yang ditinggalkan
+                except Exception:
+                    pass
+            if slot:
+                self._release_slot()
+
+    def _cancel_tasks(self, session_id: str) -> None:
+        for task in list(self._tasks.get(session_id, ())):
+            task.cancel()
+
+    # Aman dipanggil dari thread mana pun (mis. tombol "Sesi Baru")
+    def cancel_session(self, session_id: str) -> None:
+        self._loop.call_soon_threadsafe(self._cancel_tasks, session_id)
+
+    # === Jembatan sinkron (script Streamlit) ===============================
+    def generate(self, session_id: str, call: AsyncFactory, timeout_s: Optional[float] = None) -> Any:
+        timeout = self.timeout_s if timeout_s is None else timeout_s
+        fut = asyncio.run_coroutine_threadsafe(self.agenerate(session_id, call, timeout), self._loop)
+        try:
+            return fut.result(max(timeout, 0.0) + 1.0)  # cadangan; deadline utama ditegakkan di loop
+        except GenerationTimeout:
+            raise  # turunan TimeoutError; jangan tertangkap cabang cadangan di bawah
+        except concurrent.futures.CancelledError:
+            raise GenerationCancelled("Panggilan model dibatalkan.") from None
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+            raise GenerationTimeout("Model tidak merespons.") from None
+
+    def stream(self, session_id: str, factory: AsyncFactory, timeout_s: Optional[float] = None) -> Iterator[Any]:
+        out: "queue.Queue[Any]" = queue.Queue()
+
+        async def _pump() -> None:
+            try:
+                async for chunk in self.astream(session_id, factory, timeout_s):
+                    out.put((_CHUNK, chunk))
+                out.put((_END, None))
+            except asyncio.CancelledError:
+                out.put((_ERR, GenerationCancelled("Stream model dibatalkan.")))
+            except BaseException as e:
+                out.put((_ERR, e))
+
+        fut = asyncio.run_coroutine_threadsafe(_pump(), self._loop)
+
+        def _iter() -> Iterator[Any]:
+            try:
+                while True:
+                    kind, value = out.get()
+                    if kind == _CHUNK:
+                        yield value
+                    elif kind == _END:
+                        return
+                    else:
+                        raise value
+            finally:
+                fut.cancel()  # konsumen berhenti (rerun/exception) -> batalkan stream di loop
+
+        return _iter()
+
+    # Panggilan ringan (warm-up) di loop yang sama -> memakai pool koneksi async yang
+    # sama dengan generate/stream; tanpa semaphore/limiter dan tidak masuk metrik
+    def ping(self, call: AsyncFactory, timeout_s: float = 10.0) -> Any:
+        async def _ping() -> Any:
+            return await asyncio.wait_for(_resolve(call()), timeout_s)
+        return asyncio.run_coroutine_threadsafe(_ping(), self._loop).result(timeout_s + 1.0)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": self._queued,
+                "peak_active": self._peak_active,
+                "peak_queued": self._peak_queued,
+                "completed": self._completed,
+                "timeouts": self._timeouts,
+                "cancelled": self._cancelled,
+                "errors": self._errors,
+                "max_concurrency": self.max_concurrency,
+            }
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+
+def core_from_env(limiter: Any = None) -> GenerationCore:
+    return GenerationCore(
+        limiter,
+        max_concurrency=int(env_float("GENAI_MAX_CONCURRENCY", 16)),
+        timeout_s=env_float("GENAI_CALL_TIMEOUT", 60.0),
+        stall_s=env_float("GENAI_STALL_TIMEOUT", 20.0),
+    )
+
+
+# === C1: Stress test terhadap stub lokal =====================================
+class _StubModels:
+    # Meniru client.aio.models: stream chunk dengan latensi simulasi; sebagian macet
+    def __init__(self, chunks: int, chunk_s: float, hang_every: int):
+        self.chunks = chunks
+        self.chunk_s = chunk_s
+        self.hang_every = hang_every
+        self._n = 0
+
+    async def generate_content_stream(self, contents: str) -> AsyncIterator[str]:
+        self._n += 1
+        hang = self.hang_every and self._n % self.hang_every == 0
+
+        async def _gen() -> AsyncIterator[str]:
+            for i in range(self.chunks):
+                await asyncio.sleep(3600 if hang and i == 1 else self.chunk_s)
+                yield f"{contents}:{i} "
+        return _gen()
+
+
+def _stress(n_sessions: int, args: argparse.Namespace) -> Dict[str, Any]:
+    from ratelimit import RateLimiter, TokenBucket
+
+    limiter = RateLimiter(TokenBucket(rate=1e6, burst=1e6))  # limiter ikut diuji, tanpa throttling
+    core = GenerationCore(limiter, max_concurrency=args.concurrency, timeout_s=args.timeout, stall_s=args.stall)
+    stub = _StubModels(args.chunks, args.chunk_s, args.hang_every)
+    base_threads = threading.active_count()
+    peak_threads = base_threads
+    outcome = {"ok": 0, "timeout": 0, "cancelled": 0}
+
+    async def _session(i: int) -> None:
+        try:
+            async for _ in core.astream(f"s{i}", lambda: stub.generate_content_stream(f"s{i}")):
+                pass
+            outcome["ok"] += 1
+        except GenerationTimeout:
+            outcome["timeout"] += 1
+        except asyncio.CancelledError:
+            outcome["cancelled"] += 1
+
+    async def _all() -> None:
+        tasks = [asyncio.ensure_future(_session(i)) for i in range(n_sessions)]
+        await asyncio.sleep(args.chunk_s * 1.5)
+        for i in range(0, n_sessions, args.cancel_every):
+            core.cancel_session(f"s{i}")  # mis. trainee menekan "Sesi Baru" di tengah balasan
+        await asyncio.gather(*tasks)
+
+    t0 = time.perf_counter()
+    fut = asyncio.run_coroutine_threadsafe(_all(), core._loop)
+    while not fut.done():
+        peak_threads = max(peak_threads, threading.active_count())
+        time.sleep(0.01)
+    fut.result()
+    elapsed = time.perf_counter() - t0
+    # Jembatan sinkron: satu thread pemanggil (seperti script Streamlit) tetap bisa dipakai
+    # Stub terpisah tanpa stream macet: hitungan panggilan stub utama bergantung pada sesi yang batal
+    clean = _StubModels(args.chunks, args.chunk_s, 0)
+    bridged = "".join(core.stream("bridge", lambda: clean.generate_content_stream("b")))
+    m = core.metrics()
+    core.close()
+    return {
+        "sessions": n_sessions,
+        "threads_base": base_threads,
+        "threads_peak": peak_threads,
+        "elapsed_s": round(elapsed, 2),
+        **outcome,
+        "peak_active": m["peak_active"],
+        "peak_queued": m["peak_queued"],
+        "bridge_ok": bridged.startswith("b:0"),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Stress test inti generasi asyncio terhadap stub lokal.")
+    ap.add_argument("--sessions", type=int, nargs="+", default=[50, 200, 1000])
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--chunks", type=int, default=5)
+    ap.add_argument("--chunk-s", type=float, default=0.05)
+    ap.add_argument("--hang-every", type=int, default=25, help="setiap stream ke-N macet setelah chunk pertama")
+    ap.add_argument("--cancel-every", type=int, default=20, help="batalkan setiap sesi ke-N di tengah stream")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--stall", type=float, default=0.5)
+    args = ap.parse_args(argv)
+    print(f"{'sesi':>6} {'thread awal':>11} {'thread puncak':>13} {'waktu':>7} {'ok':>5} {'timeout':>7} {'batal':>5} {'puncak aktif':>12} {'puncak antre':>12}  bridge")
+    for n in args.sessions:
+        r = _stress(n, args)
+        print(f"{r['sessions']:>6} {r['threads_base']:>11} {r['threads_peak']:>13} {r['elapsed_s']:>6}s "
+              f"{r['ok']:>5} {r['timeout']:>7} {r['cancelled']:>5} {r['peak_active']:>12} {r['peak_queued']:>12}  {r['bridge_ok']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+# batch_runner.py
+# =============================================================================
+# Runner offline: jalankan semua kombinasi (audience, segment, skenario) dari
+# OPENER_POOL + giliran user berskrip, cek persona guard dan frasa terlarang,
+# lalu tulis laporan (pass rate + histogram latensi).
+#
+# Contoh:
+#   python batch_runner.py --backend stub --workers 8
+#   python batch_runner.py --backend genai --model gemini-2.5-flash --report report.md
+#   GENAI_REPLAY_MODE=replay python batch_runner.py --backend genai   # tanpa jaringan
+# =============================================================================
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from messages import ChatMessage
+from prompts import (
+    OPENER_POOL,
+    build_prompt,
+    build_system_prompt,
+    find_stop_phrases,
+    persona_misaligned,
+)
+from replay import normalize_prompt
+
+DEFAULT_TURNS = [
+    "Halo, boleh cerita sedikit kendala belajarnya seperti apa?",
+    "Sudah berapa lama kendala itu terasa?",
+    "Biasanya belajar di rumah polanya seperti apa?",
+    "Kalau ada solusi, yang paling diharapkan apa?",
+]
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0]
+
+
+# === B1: Backend ==============================================================
+class StubBackend:
+    # Balasan lokal deterministik (per prompt ternormalisasi) + latensi buatan
+    LINES = [
+        "Iya, itu yang lagi jadi pikiran belakangan ini.",
+        "Jujur agak bingung harus mulai dari mana.",
+        "Sudah dicoba beberapa cara tapi belum konsisten.",
+        "Paling berat kalau sudah dekat ulangan.",
+    ]
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5):
+        self.latency = latency
+        self.jitter = jitter
+
+    def generate(self, case_id: str, prompt: str, system: str, temperature: float) -> str:
+        seed = int(hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()[:12], 16)
+        rng = random.Random(seed)
+        time.sleep(self.latency * (1 + rng.uniform(-self.jitter, self.jitter)))
+        return rng.choice(self.LINES) + " Menurut Anda gimana?"
+
+
+class GenaiBackend:
+    # Model asli via google-genai; tetap lewat rate limiter dan record/replay
+    def __init__(self, model: str):
+        from google import genai
+        from google.genai import types
+        from ratelimit import limiter_from_env
+        from replay import replay_from_env
+
+        key = next((os.getenv(k) for k in ("GOOGLE_API_KEY", "GEMINI_API_KEY", "GENAI_API_KEY") if os.getenv(k)), "")
+        self.model = model
+        self.types = types
+        self.client = genai.Client(api_key=key) if key else None
+        self.limiter = limiter_from_env()
+        self.replay = replay_from_env(Path(__file__).with_name("replay_cache"))
+        if self.client is None and self.replay.mode != "replay":
+            raise RuntimeError("GOOGLE_API_KEY tidak ditemukan (atau pakai GENAI_REPLAY_MODE=replay).")
+
+    def generate(self, case_id: str, prompt: str, system: str, temperature: float) -> str:
+        cfg = self.types.GenerateContentConfig(
+            system_instruction=system,
+            temperature=temperature,
+            top_p=0.9,
+            top_k=40,
+            max_output_tokens=256,
+            candidate_count=1,
+        )
+        resp = self.replay.generate(
+            self.model, prompt, cfg,
+            lambda: self.limiter.call(
+                case_id, self.client.models.generate_content,
+                model=self.model, contents=prompt, config=cfg,
+            ),
+        )
+        return (getattr(resp, "text", None) or "").strip()
+
+
+_BACKENDS: Dict[str, Any] = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def _get_backend(spec: Dict[str, Any]) -> Any:
+    # Satu instance per proses (thread pool berbagi rate limiter yang sama)
+    key = json.dumps(spec, sort_keys=True)
+    with _BACKENDS_LOCK:  # worker gelombang pertama tidak boleh membuat limiter masing-masing
+        if key not in _BACKENDS:
+            if spec["name"] == "stub":
+                _BACKENDS[key] = StubBackend(spec.get("latency", 0.05))
+            elif spec["name"] == "genai":
+                _BACKENDS[key] = GenaiBackend(spec["model"])
+            else:
+                raise ValueError(f"backend tidak dikenal: {spec['name']}")
+        return _BACKENDS[key]
+
+
+# === B2: Satu kasus = opener + giliran berskrip ===============================
+def _check(audience: str, text: str) -> List[str]:
+    problems: List[str] = []
+    if not text:
+        problems.append("kosong")
+    if persona_misaligned(audience, text):
+        problems.append("persona_misaligned")
+    for p in find_stop_phrases(text):
+        problems.append(f"stop_phrase:{p}")
+    return problems
+
+
+def run_case(spec: Dict[str, Any], case: Dict[str, str], turns: List[str]) -> Dict[str, Any]:
+    compact = bool(spec.get("compact"))
+    backend = _get_backend(spec)
+    aud, seg, scenario = case["audience"], case["segment"], case["scenario"]
+    case_id = f"{aud}|{seg}|{scenario[:24]}"
+    system = build_system_prompt(aud, seg)
+    msgs: List[ChatMessage] = []
+    results: List[Dict[str, Any]] = []
+    for idx, user_line in enumerate([None] + list(turns)):
+        opener = user_line is None
+        if not opener:
+            msgs.append(ChatMessage("user", user_line))
+        # Backend menerima system prompt terpisah, jadi mode ringkas tidak mengulangnya
+        prompt = build_prompt(msgs, aud, seg, opener=opener, scenario=scenario,
+                              compact=compact, include_system=not compact)
+        t0 = time.perf_counter()
+        try:
+            text = backend.generate(case_id, prompt, system, 0.35 if opener else 0.3)
+            problems = _check(aud, text)
+        except Exception as e:
+            text, problems = "", [f"error:{type(e).__name__}: {e}"]
+        results.append({
+            "turn": idx,
+            "latency_s": round(time.perf_counter() - t0, 4),
+            "text": text,
+            "problems": problems,
+        })
+        if text:
+            msgs.append(ChatMessage("assistant", text))
+        if any(p.startswith("error:") for p in problems):
+            break
+    return {**case, "turns": results, "passed": all(not r["problems"] for r in results) and len(results) == len(turns) + 1}
+
+
+def iter_cases() -> List[Dict[str, str]]:
+    return [
+        {"audience": aud, "segment": seg, "scenario": sc}
+        for aud, by_seg in OPENER_POOL.items()
+        for seg, scenarios in by_seg.items()
+        for sc in scenarios
+    ]
+
+
+# === B3: Laporan ==============================================================
+def _histogram(values: List[float], width: int = 40) -> List[str]:
+    edges = LATENCY_BUCKETS + [float("inf")]
+    counts = [0] * len(edges)
+    for v in values:
+        counts[next(i for i, e in enumerate(edges) if v <= e)] += 1
+    peak = max(counts) or 1
+    lines, lo = [], 0.0
+    for e, c in zip(edges, counts):
+        label = f"{lo:>5.2f}-{e:<5.2f}s" if e != float("inf") else f"{lo:>5.2f}+     s"
+        lines.append(f"{label} | {'#' * round(width * c / peak):<{width}} {c}")
+        lo = e
+    return lines
+
+
+def _pct(sorted_vals: List[float], q: float) -> float:
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * q))] if sorted_vals else 0.0
+
+
+def summarize(results: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    turn_lat = sorted(t["latency_s"] for r in results for t in r["turns"])
+    case_lat = sorted(sum(t["latency_s"] for t in r["turns"]) for r in results)
+    by_group: Dict[str, List[int]] = {}
+    for r in results:
+        g = by_group.setdefault(f"{r['audience']}/{r['segment']}", [0, 0])
+        g[0] += int(r["passed"])
+        g[1] += 1
+    passed = sum(int(r["passed"]) for r in results)
+    return {
+        "cases": len(results),
+        "passed": passed,
+        "pass_rate": round(passed / len(results), 4) if results else 0.0,
+        "wall_s": round(wall_s, 2),
+        "turns": len(turn_lat),
+        "turn_latency_p50_s": _pct(turn_lat, 0.5),
+        "turn_latency_p95_s": _pct(turn_lat, 0.95),
+        "case_latency_p50_s": _pct(case_lat, 0.5),
+        "case_latency_p95_s": _pct(case_lat, 0.95),
+        "by_group": {k: {"passed": v[0], "total": v[1]} for k, v in sorted(by_group.items())},
+        "turn_histogram": _histogram(turn_lat),
+        "case_histogram": _histogram(case_lat),
+    }
+
+
+def to_markdown(summary: Dict[str, Any], results: List[Dict[str, Any]], backend: str) -> str:
+    lines = [
+        "# Batch Scenario Report - RG Telesales Role-Play",
+        "",
+        f"- Backend: {backend}",
+        f"- Kasus: {summary['cases']} | Lulus: {summary['passed']} | Pass rate: {summary['pass_rate']:.1%}",
+        f"- Giliran: {summary['turns']} | Wall time: {summary['wall_s']} s",
+        f"- Latensi giliran p50/p95: {summary['turn_latency_p50_s']:.3f} / {summary['turn_latency_p95_s']:.3f} s",
+        f"- Latensi kasus p50/p95: {summary['case_latency_p50_s']:.3f} / {summary['case_latency_p95_s']:.3f} s",
+        "",
+        "## Per audience/segment",
+        "",
+        "| Grup | Lulus | Total |",
+        "|---|---|---|",
+    ]
+    lines += [f"| {g} | {v['passed']} | {v['total']} |" for g, v in summary["by_group"].items()]
+    lines += ["", "## Histogram latensi per giliran", "", "```", *summary["turn_histogram"], "```"]
+    lines += ["", "## Histogram latensi per kasus", "", "```", *summary["case_histogram"], "```"]
+    failed = [r for r in results if not r["passed"]]
+    if failed:
+        lines += ["", "## Gagal", ""]
+        for r in failed:
+            probs = sorted({p for t in r["turns"] for p in t["problems"]}) or ["giliran tidak lengkap"]
+            lines.append(f"- {r['audience']}/{r['segment']} - {r['scenario']}: {', '.join(probs)}")
+    return "\n".join(lines) + "\n"
+
+
+# === B4: CLI ==================================================================
+def _load_turns(path: Optional[str]) -> List[str]:
+    if not path:
+        return list(DEFAULT_TURNS)
+    raw = Path(path).read_text(encoding="utf-8")
+    if path.endswith(".json"):
+        return [str(t) for t in json.loads(raw)]
+    return [ln.strip() for ln in raw.splitlines() if ln.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Jalankan semua skenario role-play secara offline.")
+    ap.add_argument("--backend", choices=["stub", "genai"], default="stub")
+    ap.add_argument("--model", default=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"))
+    ap.add_argument("--stub-latency", type=float, default=0.05, help="latensi rata-rata backend stub (detik)")
+    ap.add_argument("--compact", action="store_true", help="pakai prompt ringkas (PROMPT_COMPACT)")
+    ap.add_argument("--turns-file", help="giliran user berskrip (.txt satu per baris, atau .json list)")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--pool", choices=["thread", "process"], default="thread",
+                    help="process: rate limiter per proses (pakai GENAI_RATE_LOCK_FILE untuk berbagi)")
+    ap.add_argument("--report", default="batch_report.md")
+    ap.add_argument("--json", dest="json_path", help="simpan hasil mentah + ringkasan sebagai JSON")
+    ap.add_argument("--min-pass-rate", type=float, help="exit 1 jika pass rate di bawah nilai ini (0..1)")
+    args = ap.parse_args(argv)
+
+    spec: Dict[str, Any] = {"name": args.backend, "compact": args.compact}
+    if args.backend == "stub":
+        spec["latency"] = args.stub_latency
+    else:
+        spec["model"] = args.model
+    turns = _load_turns(args.turns_file)
+    cases = iter_cases()
+
+    pool_cls = ProcessPoolExecutor if args.pool == "process" else ThreadPoolExecutor
+    t0 = time.perf_counter()
+    with pool_cls(max_workers=max(1, args.workers)) as ex:
+        results = list(ex.map(run_case, [spec] * len(cases), cases, [turns] * len(cases)))
+    summary = summarize(results, time.perf_counter() - t0)
+
+    Path(args.report).write_text(to_markdown(summary, results, args.backend), encoding="utf-8")
+    if args.json_path:
+        Path(args.json_path).write_text(
+            json.dumps({"summary": summary, "results": results}, ensure_ascii=False, indent=1), encoding="utf-8"
+        )
+    print(f"{summary['passed']}/{summary['cases']} lulus ({summary['pass_rate']:.1%}), "
+          f"p95 giliran {summary['turn_latency_p95_s']:.3f} s, wall {summary['wall_s']} s -> {args.report}")
+    if args.min_pass_rate is not None and summary["pass_rate"] < args.min_pass_rate:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
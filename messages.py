@@ -0,0 +1,112 @@
+# messages.py
+# =============================================================================
+# Representasi pesan chat yang ringkas (slotted) dengan flag internal eksplisit.
+# - internal=True menandai pesan sintetis (mis. "⏩ OPENER") -> filter O(1)
+# - estimasi panjang/token di-cache per pesan
+# - serialisasi tetap ke JSON lama: {"role": ..., "content": ...}
+# Jalankan `python messages.py` untuk benchmark sesi 1.000 pesan.
+# =============================================================================
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+# Perkiraan kasar jumlah token (kata + tanda baca); cukup untuk anggaran/perbandingan
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text or ""))
+
+
+class ChatMessage:
+    # Anggap immutable: cache panjang/token bergantung pada content yang tetap
+    __slots__ = ("role", "content", "internal", "_n_tokens")
+
+    def __init__(self, role: str, content: str, internal: bool = False):
+        self.role = role
+        self.content = content or ""
+        self.internal = bool(internal)
+        self._n_tokens: Optional[int] = None
+
+    @property
+    def n_chars(self) -> int:
+        return len(self.content)
+
+    # Perkiraan token dihitung sekali per pesan
+    @property
+    def n_tokens(self) -> int:
+        if self._n_tokens is None:
+            self._n_tokens = estimate_tokens(self.content)
+        return self._n_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {"role": self.role, "content": self.content}
+        if self.internal:
+            d["internal"] = True
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "ChatMessage":
+        return cls(d.get("role", "user"), d.get("content", ""), bool(d.get("internal", False)))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ChatMessage):
+            return NotImplemented
+        return (self.role, self.content, self.internal) == (other.role, other.content, other.internal)
+
+    def __repr__(self) -> str:
+        flag = ", internal=True" if self.internal else ""
+        return f"ChatMessage({self.role!r}, {self.content[:30]!r}{flag})"
+
+
+def visible(msgs: Iterable[ChatMessage]) -> Iterator[ChatMessage]:
+    return (m for m in msgs if not m.internal)
+
+
+def messages_to_json(msgs: Iterable[ChatMessage]) -> str:
+    return json.dumps([m.to_dict() for m in msgs], ensure_ascii=False)
+
+
+def messages_from_json(raw: Optional[str]) -> List[ChatMessage]:
+    if not raw:
+        return []
+    return [ChatMessage.from_dict(d) for d in json.loads(raw)]
+
+
+# === Benchmark: memori per sesi + biaya filter per rerun =====================
+def _bench(n: int = 1000, reruns: int = 200) -> None:
+    import time
+    import tracemalloc
+
+    triggers = ["⏩ OPENER"] * (n // 20)  # satu trigger per ~20 pesan, seperti pola opener
+
+    def _texts() -> List[str]:
+        return [("pesan ke-%d " % i) + "lorem ipsum dolor " * (i % 7 + 1) for i in range(n)]
+
+    tracemalloc.start()
+    base = tracemalloc.take_snapshot()
+    legacy = [{"role": "user" if i % 2 else "assistant", "content": t} for i, t in enumerate(_texts())]
+    legacy_mem = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(base, "filename"))
+    base = tracemalloc.take_snapshot()
+    compact = [ChatMessage("user" if i % 2 else "assistant", t, internal=(i % 20 == 0)) for i, t in enumerate(_texts())]
+    compact_mem = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(base, "filename"))
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for _ in range(reruns):
+        [m for m in legacy if m["content"] not in triggers]
+    legacy_us = (time.perf_counter() - t0) / reruns * 1e6
+    t0 = time.perf_counter()
+    for _ in range(reruns):
+        list(visible(compact))
+    compact_us = (time.perf_counter() - t0) / reruns * 1e6
+
+    print(f"{n} pesan, {len(triggers)} trigger internal")
+    print(f"memori  dict+list : {legacy_mem / 1024:8.1f} KiB")
+    print(f"memori  ChatMessage: {compact_mem / 1024:8.1f} KiB")
+    print(f"filter  dict+list : {legacy_us:8.1f} us/rerun")
+    print(f"filter  ChatMessage: {compact_us:8.1f} us/rerun")
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,57 @@
+# pages/1_Dashboard.py
+# =============================================================================
+# Dashboard manajer: sesi, rata-rata giliran, dan pemakaian opener per hari
+# per audience/segment. Hanya membaca tabel daily_summary (ukurannya tetap
+# kecil berapa pun banyaknya riwayat); rebuild: python analytics.py rebuild
+# =============================================================================
+from datetime import date, timedelta
+
+import streamlit as st
+
+from analytics import read_summary
+from storage import DB_PATH, open_db
+
+st.set_page_config(page_title="RG Telesales - Dashboard", layout="wide")
+
+@st.cache_resource(show_spinner=False)
+def _get_db():
+    return open_db(DB_PATH)
+
+st.markdown("## Dashboard Role-Play")
+days = st.selectbox("Rentang", [7, 30, 90], index=1, format_func=lambda d: f"{d} hari terakhir")
+since = (date.today() - timedelta(days=days - 1)).isoformat()
+rows = read_summary(_get_db(), since_day=since)
+
+if not rows:
+    st.info("Belum ada sesi pada rentang ini.")
+    st.stop()
+
+total_sessions = sum(r["sessions"] for r in rows)
+total_turns = sum(r["turns"] for r in rows)
+c1, c2, c3 = st.columns(3)
+c1.metric("Sesi", total_sessions)
+c2.metric("Rata-rata giliran", f"{total_turns / total_sessions:.1f}" if total_sessions else "0")
+c3.metric("Opener dipakai", sum(r["openers"] for r in rows))
+
+st.subheader("Sesi per hari", anchor=False)
+st.bar_chart(
+    [{"hari": r["day"], "grup": f"{r['audience']}/{r['segment']}", "sesi": r["sessions"]} for r in rows],
+    x="hari", y="sesi", color="grup",
+)
+
+st.subheader("Rincian per audience/segment", anchor=False)
+st.dataframe(
+    [
+        {
+            "Hari": r["day"],
+            "Audience": r["audience"] or "-",
+            "Segmen": r["segment"] or "-",
+            "Sesi": r["sessions"],
+            "Rata-rata giliran": r["avg_turns"],
+            "Opener": r["openers"],
+        }
+        for r in rows
+    ],
+    use_container_width=True,
+    hide_index=True,
+)
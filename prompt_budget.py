@@ -0,0 +1,82 @@
+# prompt_budget.py
+# =============================================================================
+# Benchmark ukuran prompt per giliran untuk setiap kombinasi audience/segment.
+# Token = perkiraan kasar (messages.estimate_tokens) dari teks prompt + system
+# instruction yang ikut terkirim di config (SDK baru). Exit 1 jika ada
+# kombinasi pada mode yang dicek melewati anggaran mode itu -> cocok untuk CI.
+# Default: cek mode yang dipakai app (PROMPT_COMPACT=1 -> compact, selain itu full).
+#
+#   python prompt_budget.py                     # cek mode app, tampilkan keduanya
+#   python prompt_budget.py --check both --budget 550 --budget-full 900
+# =============================================================================
+import os
+import sys
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+from messages import ChatMessage, estimate_tokens
+from prompts import OPENER_POOL, SEG_RULES, build_prompt, build_system_prompt
+
+DEFAULT_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "550") or 550)
+DEFAULT_BUDGET_FULL = int(os.getenv("PROMPT_TOKEN_BUDGET_FULL", "900") or 900)
+APP_MODE = "compact" if os.getenv("PROMPT_COMPACT") == "1" else "full"
+
+# Riwayat representatif: cukup panjang agar history_window_for() memakai jendela maksimum
+_SAMPLE_TURNS = [
+    ("user", "Halo, selamat siang. Boleh cerita sedikit kendala belajarnya seperti apa akhir-akhir ini?"),
+    ("assistant", "Belakangan nilai ulangannya turun, terutama kalau soal cerita. Kira-kira mulai dari mana ya?"),
+]
+
+
+def sample_history(n: int = 14) -> List[ChatMessage]:
+    return [ChatMessage(*_SAMPLE_TURNS[i % 2]) for i in range(n)]
+
+
+def measure(audience: str, segment: str, compact: bool) -> Dict[str, int]:
+    # Full = perilaku lama: system prompt di dalam prompt DAN di system_instruction
+    system_tokens = estimate_tokens(build_system_prompt(audience, segment))
+    scenario = OPENER_POOL[audience][segment][0]
+    opener = build_prompt([], audience, segment, opener=True, scenario=scenario,
+                          compact=compact, include_system=not compact)
+    dialog = build_prompt(sample_history(), audience, segment,
+                          compact=compact, include_system=not compact)
+    return {
+        "system": system_tokens,
+        "opener": estimate_tokens(opener) + system_tokens,
+        "dialog": estimate_tokens(dialog) + system_tokens,
+    }
+
+
+def run(budgets: Dict[str, int], check: str) -> Tuple[List[str], bool]:
+    lines = [f"{'audience/segment':<16} {'mode':<8} {'system':>6} {'opener':>6} {'dialog':>6}  status"]
+    ok = True
+    for aud in OPENER_POOL:
+        for seg in SEG_RULES:
+            for mode in ("full", "compact"):
+                r = measure(aud, seg, compact=(mode == "compact"))
+                worst = max(r["opener"], r["dialog"])
+                checked = check in (mode, "both")
+                over = checked and worst > budgets[mode]
+                ok = ok and not over
+                status = ("MELEBIHI" if over else "ok") if checked else "-"
+                lines.append(f"{aud + '/' + seg:<16} {mode:<8} {r['system']:>6} {r['opener']:>6} {r['dialog']:>6}  {status}")
+    lines.append(
+        f"anggaran per giliran: compact {budgets['compact']}, full {budgets['full']} token (mode dicek: {check})"
+    )
+    return lines, ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark anggaran token prompt per giliran.")
+    ap.add_argument("--budget", type=int, default=DEFAULT_BUDGET, help="anggaran mode compact")
+    ap.add_argument("--budget-full", type=int, default=DEFAULT_BUDGET_FULL, help="anggaran mode full")
+    ap.add_argument("--check", choices=["compact", "full", "both"], default=APP_MODE,
+                    help="default: mode yang dipakai app (PROMPT_COMPACT)")
+    args = ap.parse_args(argv)
+    lines, ok = run({"compact": args.budget, "full": args.budget_full}, args.check)
+    print("\n".join(lines))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+# ratelimit.py
+# =============================================================================
+# Rate limiter bersama untuk semua panggilan model dalam satu replika.
+# - Token bucket global (opsional: koordinasi antar-replika lewat file lock)
+# - Antrian adil per sesi (round-robin antar sesi yang sedang menunggu)
+# - Backoff eksponensial + jitter saat kena 429
+# - Metrik kedalaman antrian dan waktu tunggu
+# =============================================================================
+import os
+import json
+import asyncio
+import time
+import random
+import itertools
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+try:
+    import fcntl  # hanya tersedia di POSIX
+except Exception:
+    fcntl = None
+
+
+class RateLimitTimeout(RuntimeError):
+    pass
+
+
+# Interval poll acquire_async; pemberi token sinkron tidak bisa membangunkan coroutine
+_ASYNC_POLL_S = 0.05
+
+
+# Dipakai juga oleh async_core dan warmup untuk membaca konfigurasi GENAI_*
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    # google-genai: APIError.code; google.api_core: ResourceExhausted.code; httpx: status_code
+    for attr in ("code", "status_code"):
+        v = getattr(exc, attr, None)
+        if callable(v):
+            continue
+        try:
+            if v is not None and int(v) == 429:
+                return True
+        except (TypeError, ValueError):
+            pass
+    msg = str(exc)
+    return "429" in msg or "RESOURCE_EXHAUSTED" in msg or "ResourceExhausted" in type(exc).__name__
+
+
+# === R1: Token bucket (per proses) ===========================================
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(float(rate), 1e-6)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    # 0.0 jika token didapat; selain itu perkiraan detik sampai token tersedia
+    def try_take(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if now < self._cooldown_until:
+                return self._cooldown_until - now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+    # Jeda global setelah 429: semua sesi ikut menahan diri
+    def penalize(self, seconds: float) -> None:
+        with self._lock:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + seconds)
+
+
+# === R2: Token bucket berbasis file (beberapa replika di satu host) ==========
+class FileTokenBucket:
+    def __init__(self, path: str, rate: float, burst: float):
+        if fcntl is None:
+            raise RuntimeError("FileTokenBucket membutuhkan fcntl (POSIX).")
+        self.path = path
+        self.rate = max(float(rate), 1e-6)
+        self.burst = max(float(burst), 1.0)
+
+    def _with_state(self, fn: Callable[[Dict[str, float], float], Any]) -> Any:
+        with open(self.path, "a+", encoding="utf-8") as fh:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                raw = fh.read()
+                try:
+                    state = json.loads(raw) if raw.strip() else {}
+                except ValueError:
+                    state = {}
+                # wall clock, karena monotonic tidak sebanding antar proses
+                now = time.time()
+                stamp = float(state.get("stamp", now))
+                tokens = float(state.get("tokens", self.burst))
+                state["tokens"] = min(self.burst, tokens + max(0.0, now - stamp) * self.rate)
+                state["stamp"] = now
+                result = fn(state, now)
+                fh.seek(0)
+                fh.truncate()
+                fh.write(json.dumps(state))
+                fh.flush()
+                return result
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def try_take(self) -> float:
+        def _take(state: Dict[str, float], now: float) -> float:
+            cool = float(state.get("cooldown_until", 0.0))
+            if now < cool:
+                return cool - now
+            if state["tokens"] >= 1.0:
+                state["tokens"] -= 1.0
+                return 0.0
+            return (1.0 - state["tokens"]) / self.rate
+        return self._with_state(_take)
+
+    def penalize(self, seconds: float) -> None:
+        def _pen(state: Dict[str, float], now: float) -> None:
+            state["cooldown_until"] = max(float(state.get("cooldown_until", 0.0)), now + seconds)
+        self._with_state(_pen)
+
+
+# === R3: Penjadwal adil + backoff ============================================
+class RateLimiter:
+    def __init__(
+        self,
+        bucket: Any,
+        max_retries: int = 4,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 20.0,
+        max_wait: float = 60.0,
+    ):
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        # session_id -> tiket antre; urutan dict = giliran round-robin
+        self._queues: "OrderedDict[str, Deque[int]]" = OrderedDict()
+        self._tickets = itertools.count()
+        self._rng = random.Random()  # jangan sentuh RNG global
+        # metrik
+        self._waits: Deque[float] = deque(maxlen=512)
+        self._depth = 0
+        self._max_depth = 0
+        self._granted = 0
+        self._throttled = 0
+        self._timeouts = 0
+
+    def _drop_ticket(self, session_id: str, ticket: int) -> None:
+        q = self._queues.get(session_id)
+        if q is None:
+            return
+        try:
+            q.remove(ticket)
+        except ValueError:
+            return
+        self._depth -= 1
+        if not q:
+            del self._queues[session_id]
+
+    def acquire(self, session_id: str, timeout: Optional[float] = None) -> float:
+        start = time.monotonic()
+        deadline = start + (self.max_wait if timeout is None else timeout)
+        with self._cond:
+            ticket = next(self._tickets)
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._depth += 1
+            self._max_depth = max(self._max_depth, self._depth)
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise RateLimitTimeout("Antrian model penuh; coba lagi sebentar.")
+                    head_sid = next(iter(self._queues))
+                    if head_sid == session_id and self._queues[head_sid][0] == ticket:
+                        wait = self.bucket.try_take()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(timeout=min(wait, remaining))
+                    else:
+                        self._cond.wait(timeout=remaining)
+            except BaseException:
+                self._drop_ticket(session_id, ticket)
+                self._cond.notify_all()
+                raise
+            return self._grant(session_id, start)
+
+    # Dipanggil dengan self._cond terkunci, saat tiket sesi ada di kepala antrian
+    def _grant(self, session_id: str, start: float) -> float:
+        q = self._queues[session_id]
+        q.popleft()
+        self._depth -= 1
+        if q:
+            self._queues.move_to_end(session_id)  # giliran sesi lain dulu
+        else:
+            del self._queues[session_id]
+        waited = time.monotonic() - start
+        self._waits.append(waited)
+        self._granted += 1
+        self._cond.notify_all()
+        return waited
+
+    # Versi asyncio: antrian adil yang sama, tetapi menunggu dengan asyncio.sleep
+    # (poll singkat) agar event loop tidak terblokir
+    async def acquire_async(self, session_id: str, timeout: Optional[float] = None) -> float:
+        start = time.monotonic()
+        deadline = start + (self.max_wait if timeout is None else timeout)
+        with self._cond:
+            ticket = next(self._tickets)
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._depth += 1
+            self._max_depth = max(self._max_depth, self._depth)
+        try:
+            while True:
+                with self._cond:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise RateLimitTimeout("Antrian model penuh; coba lagi sebentar.")
+                    head_sid = next(iter(self._queues))
+                    wait = _ASYNC_POLL_S
+                    if head_sid == session_id and self._queues[head_sid][0] == ticket:
+                        wait = self.bucket.try_take()
+                        if wait <= 0:
+                            return self._grant(session_id, start)
+                await asyncio.sleep(min(wait, remaining, _ASYNC_POLL_S))
+        except BaseException:
+            with self._cond:
+                self._drop_ticket(session_id, ticket)
+                self._cond.notify_all()
+            raise
+
+    def _backoff(self, attempt: int) -> float:
+        d = min(self.backoff_cap, self.backoff_base * (2 ** attempt))
+        return d / 2 + self._rng.uniform(0, d / 2)
+
+    def call(self, session_id: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        attempt = 0
+        while True:
+            self.acquire(session_id)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= self.max_retries:
+                    raise
+                with self._cond:
+                    self._throttled += 1
+                # jeda dibagi ke bucket agar sesi lain tidak ikut menyerbu
+                self.bucket.penalize(self._backoff(attempt))
+                attempt += 1
+
+    # fn: fungsi tanpa argumen yang mengembalikan awaitable (mis. client.aio.models...)
+    async def call_async(self, session_id: str, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        attempt = 0
+        while True:
+            await self.acquire_async(session_id, timeout)
+            try:
+                return await fn()
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= self.max_retries:
+                    raise
+                with self._cond:
+                    self._throttled += 1
+                self.bucket.penalize(self._backoff(attempt))
+                attempt += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            waits = sorted(self._waits)
+            n = len(waits)
+            return {
+                "queue_depth": self._depth,
+                "sessions_waiting": len(self._queues),
+                "max_queue_depth": self._max_depth,
+                "granted": self._granted,
+                "throttled_429": self._throttled,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": round(1000 * sum(waits) / n, 1) if n else 0.0,
+                "wait_p95_ms": round(1000 * waits[min(n - 1, int(n * 0.95))], 1) if n else 0.0,
+                "wait_max_ms": round(1000 * waits[-1], 1) if n else 0.0,
+            }
+
+
+def limiter_from_env() -> RateLimiter:
+    rps = env_float("GENAI_RPS", 4.0)
+    burst = env_float("GENAI_BURST", 8.0)
+    lock_path = os.getenv("GENAI_RATE_LOCK_FILE", "").strip()
+    if lock_path and fcntl is not None:
+        bucket: Any = FileTokenBucket(lock_path, rps, burst)
+    else:
+        bucket = TokenBucket(rps, burst)
+    return RateLimiter(
+        bucket,
+        max_retries=int(env_float("GENAI_MAX_RETRIES", 4)),
+        backoff_base=env_float("GENAI_BACKOFF_BASE", 1.0),
+        backoff_cap=env_float("GENAI_BACKOFF_CAP", 20.0),
+        max_wait=env_float("GENAI_MAX_QUEUE_WAIT", 60.0),
+    )
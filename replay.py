@@ -0,0 +1,190 @@
+# replay.py
+# =============================================================================
+# Record/replay respons model untuk demo dan uji yang deterministik.
+# - Kunci = sha256(model, prompt ternormalisasi, config)
+# - record : teruskan ke model asli, simpan chunk + offset waktunya ke disk
+# - replay : sajikan dari disk (kecepatan asli atau instan), tanpa jaringan
+# Mode lewat env: GENAI_REPLAY_MODE=record|replay, GENAI_REPLAY_INSTANT=1,
+# GENAI_REPLAY_DIR=<folder> (default: replay_cache/ di samping app.py).
+# =============================================================================
+import os
+import re
+import json
+import time
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+_VOLATILE_META = re.compile(r'"(time|nonce)":\s*("[^"]*"|\d+)')
+_WS = re.compile(r"\s+")
+
+
+class ReplayMiss(KeyError):
+    pass
+
+
+class ReplayChunk:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ReplayResponse:
+    # Cukup mirip respons SDK untuk _extract_text_from_response()
+    __slots__ = ("text", "candidates", "prompt_feedback")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.candidates: List[Any] = []
+        self.prompt_feedback = None
+
+
+def normalize_prompt(prompt: str) -> str:
+    # [META] memuat waktu dan nonce; buang agar prompt yang sama menghasilkan kunci sama
+    return _WS.sub(" ", _VOLATILE_META.sub(r'"\1": null', prompt or "")).strip()
+
+
+def config_fingerprint(cfg: Any) -> Any:
+    if cfg is None or isinstance(cfg, (dict, list, str, int, float, bool)):
+        return cfg
+    dump = getattr(cfg, "model_dump", None)  # pydantic (google-genai)
+    if callable(dump):
+        try:
+            return dump(exclude_none=True, mode="json")
+        except Exception:
+            pass
+    return repr(cfg)
+
+
+def _text_attr(obj: Any) -> Optional[str]:
+    t = getattr(obj, "text", None)
+    return t if isinstance(t, str) else None
+
+
+class ReplayCache:
+    def __init__(self, root: Path, mode: str = "", instant: bool = False):
+        self.root = Path(root)
+        self.mode = (mode or "").strip().lower()
+        self.instant = instant
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    @property
+    def active(self) -> bool:
+        return self.mode in ("record", "replay")
+
+    def key(self, model: str, prompt: str, config: Any) -> str:
+        payload = json.dumps(
+            [model, normalize_prompt(prompt), config_fingerprint(config)],
+            ensure_ascii=False, sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        p = self._path(key)
+        if not p.exists():
+            return None
+        try:
+            return json.loads(p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key: str, model: str, prompt: str, chunks: List[Dict[str, Any]]) -> None:
+        p = self._path(key)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps(
+                {
+                    "model": model,
+                    "prompt": normalize_prompt(prompt),
+                    "recorded_at": datetime.now().isoformat(timespec="seconds"),
+                    "chunks": chunks,
+                },
+                ensure_ascii=False, indent=1,
+            ),
+            encoding="utf-8",
+        )
+        os.replace(tmp, p)  # atomik: pembaca tidak pernah melihat file setengah jadi
+        self.recorded += 1
+
+    def _replay_chunks(self, rec: Dict[str, Any]) -> Iterator[ReplayChunk]:
+        start = time.perf_counter()
+        for c in rec.get("chunks", []):
+            if not self.instant:
+                delay = float(c.get("t", 0.0)) - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield ReplayChunk(c.get("text", ""))
+
+    def _lookup(self, model: str, prompt: str, config: Any):
+        key = self.key(model, prompt, config)
+        if self.mode != "replay":
+            return key, None
+        rec = self._load(key)
+        if rec is None:
+            self.misses += 1
+            raise ReplayMiss(f"tidak ada rekaman untuk {model} ({key[:12]})")
+        self.hits += 1
+        return key, rec
+
+    def stream(
+        self,
+        model: str,
+        prompt: str,
+        config: Any,
+        factory: Callable[[], Iterable[Any]],
+        extract: Callable[[Any], Optional[str]] = _text_attr,
+    ) -> Iterator[Any]:
+        if not self.active:
+            return iter(factory())
+        key, rec = self._lookup(model, prompt, config)
+        if rec is not None:
+            return self._replay_chunks(rec)
+        return self._record_stream(key, model, prompt, factory, extract)
+
+    def _record_stream(self, key, model, prompt, factory, extract) -> Iterator[Any]:
+        start = time.perf_counter()
+        chunks: List[Dict[str, Any]] = []
+        for event in factory():
+            piece = extract(event)
+            if piece:
+                chunks.append({"t": round(time.perf_counter() - start, 4), "text": piece})
+            yield event
+        if chunks:  # hanya stream yang selesai yang disimpan
+            self._save(key, model, prompt, chunks)
+
+    def generate(
+        self,
+        model: str,
+        prompt: str,
+        config: Any,
+        call: Callable[[], Any],
+        extract: Callable[[Any], Optional[str]] = _text_attr,
+    ) -> Any:
+        if not self.active:
+            return call()
+        key, rec = self._lookup(model, prompt, config)
+        if rec is not None:
+            return ReplayResponse("".join(c.text for c in self._replay_chunks(rec)))
+        start = time.perf_counter()
+        resp = call()
+        text = extract(resp)
+        if text:
+            self._save(key, model, prompt, [{"t": round(time.perf_counter() - start, 4), "text": text}])
+        return resp
+
+
+def replay_from_env(default_root: Path) -> ReplayCache:
+    root = os.getenv("GENAI_REPLAY_DIR", "").strip() or str(default_root)
+    return ReplayCache(
+        Path(root),
+        mode=os.getenv("GENAI_REPLAY_MODE", ""),
+        instant=os.getenv("GENAI_REPLAY_INSTANT", "") == "1",
+    )
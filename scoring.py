@@ -0,0 +1,350 @@
+# scoring.py
+# =============================================================================
+# Penilaian performa trainee di background (tidak memblokir generate_reply()).
+# - Antrian job persisten di SQLite (tabel score_job), diisi dari jalur simpan
+# - Worker pool berukuran tetap; klaim job atomik, lease untuk job macet
+# - Rubrik berbasis aturan dulu, opsional lanjut satu pass model
+# - Hasil disimpan di convo.score_json; idempoten per hash isi percakapan
+#
+#   python scoring.py run --workers 4 --once   # proses antrian, laporkan throughput
+#   python scoring.py enqueue-all              # backfill semua percakapan
+#   python scoring.py status
+# =============================================================================
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+RUBRIC_VERSION = 1
+LEASE_S = 300.0  # job 'running' lebih lama dari ini dianggap yatim (proses mati/restart)
+# Nilai setelah percakapan diam sejenak (simpan berikutnya menggeser jadwal)
+DEBOUNCE_S = float(os.getenv("SCORING_DEBOUNCE_S", "30") or 0)
+
+
+def _now() -> float:
+    return time.time()
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS score_job(
+            convo_id TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            status TEXT NOT NULL,
+            not_before REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_score_job_ready ON score_job(status, not_before)")
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(convo)")]
+    if "score_json" not in cols:
+        conn.execute("ALTER TABLE convo ADD COLUMN score_json TEXT")
+
+
+def content_hash(messages_json: str) -> str:
+    return hashlib.sha1(f"{RUBRIC_VERSION}:{messages_json}".encode("utf-8")).hexdigest()
+
+
+# Dipanggil di dalam transaksi simpan (caller yang commit).
+# Isi sama + sudah dinilai -> no-op; isi berubah -> antre ulang dengan debounce.
+def enqueue(conn: sqlite3.Connection, convo_id: str, chash: str, debounce_s: Optional[float] = None) -> None:
+    debounce_s = DEBOUNCE_S if debounce_s is None else debounce_s
+    conn.execute(
+        "INSERT INTO score_job(convo_id,content_hash,status,not_before) VALUES(?,?,'queued',?) "
+        "ON CONFLICT(convo_id) DO UPDATE SET "
+        "status=CASE WHEN score_job.content_hash=excluded.content_hash AND score_job.status IN ('done','running') "
+        "THEN score_job.status ELSE 'queued' END, "
+        "not_before=CASE WHEN score_job.content_hash=excluded.content_hash AND score_job.status IN ('done','running') "
+        "THEN score_job.not_before ELSE excluded.not_before END, "
+        "attempts=CASE WHEN score_job.content_hash=excluded.content_hash THEN score_job.attempts ELSE 0 END, "
+        "content_hash=excluded.content_hash",
+        (convo_id, chash, _now() + debounce_s),
+    )
+
+
+def on_delete(conn: sqlite3.Connection, convo_id: str) -> None:
+    conn.execute("DELETE FROM score_job WHERE convo_id=?", (convo_id,))
+
+
+def get_score(conn: sqlite3.Connection, convo_id: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute("SELECT score_json FROM convo WHERE id=?", (convo_id,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+# === SC1: Rubrik berbasis aturan =============================================
+# Pesan role 'user' = trainee (sales), role 'assistant' = persona (Orang Tua/Murid)
+QUESTION_RE = re.compile(
+    r"\?|\b(apa|apakah|bagaimana|gimana|kenapa|mengapa|berapa|kapan|sejak|seperti apa|boleh tahu|ceritakan)\b"
+)
+PITCH_RE = re.compile(
+    r"\b(ruangbelajar|ruang belajar|ruangortu|paket|program kami|produk kami|langganan|berlangganan|"
+    r"harga|biaya|promo|diskon|daftar sekarang|beli|utbk package|tryout gratis)\b"
+)
+OBJECTION_RE = re.compile(
+    r"\b(mahal|kemahalan|nanti dulu|pikir[- ]pikir|belum butuh|tidak butuh|gak butuh|nggak butuh|"
+    r"tidak ada waktu|gak ada waktu|sibuk|sudah les|sudah ikut les|ragu|kurang yakin|tidak tertarik)\b"
+)
+ACK_RE = re.compile(r"\b(paham|mengerti|wajar|betul|benar|setuju|memang|tentu|terima kasih sudah)\b")
+MIN_DISCOVERY = 2
+
+
+def rule_score(messages: List[Any]) -> Dict[str, Any]:
+    msgs = [m for m in messages if not getattr(m, "internal", False)]
+    discovery = 0
+    first_pitch: Optional[int] = None
+    discovery_before_pitch = 0
+    objections = handled = 0
+    for i, m in enumerate(msgs):
+        low = m.content.lower()
+        if m.role == "user":
+            if PITCH_RE.search(low) and first_pitch is None:
+                first_pitch = i
+                discovery_before_pitch = discovery
+            if QUESTION_RE.search(low):
+                discovery += 1
+        elif OBJECTION_RE.search(low):
+            objections += 1
+            nxt = next((n for n in msgs[i + 1:] if n.role == "user"), None)
+            if nxt is not None and (ACK_RE.search(nxt.content.lower()) or QUESTION_RE.search(nxt.content.lower())):
+                handled += 1
+    if first_pitch is None:
+        discovery_before_pitch = discovery
+    premature = first_pitch is not None and discovery_before_pitch < MIN_DISCOVERY
+    items = {
+        "discovery_questions": {"count": discovery_before_pitch, "pass": discovery_before_pitch >= MIN_DISCOVERY},
+        "no_premature_pitch": {"first_pitch_at": first_pitch, "pass": not premature},
+        "objection_handling": {
+            "objections": objections,
+            "handled": handled,
+            "pass": None if objections == 0 else handled == objections,
+        },
+    }
+    rated = [v["pass"] for v in items.values() if v["pass"] is not None]
+    return {
+        "rubric_version": RUBRIC_VERSION,
+        "items": items,
+        "score": round(100 * sum(rated) / len(rated)) if rated else 0,
+        "turns": sum(1 for m in msgs if m.role == "user"),
+    }
+
+
+# === SC2: Pass model opsional ================================================
+def make_genai_scorer(client: Any, model: str, limiter: Any = None) -> Callable[[List[Any]], Dict[str, Any]]:
+    instr = (
+        "Nilai transkrip role-play telesales berikut. 'User' adalah trainee sales, 'Assistant' adalah calon pelanggan. "
+        "Balas HANYA JSON: {\"discovery\": 0-5, \"pitch_timing\": 0-5, \"objection_handling\": 0-5, \"catatan\": \"...\"}."
+    )
+
+    def _score(messages: List[Any]) -> Dict[str, Any]:
+        transcript = "\n".join(
+            f"{'User' if m.role == 'user' else 'Assistant'}: {m.content}"
+            for m in messages if not getattr(m, "internal", False)
+        )
+        prompt = f"{instr}\n\n[TRANSKRIP]\n{transcript}"
+        call = lambda: client.models.generate_content(model=model, contents=prompt)  # noqa: E731
+        resp = limiter.call("scoring", call) if limiter is not None else call()
+        text = (getattr(resp, "text", None) or "").strip()
+        m = re.search(r"\{.*\}", text, re.S)
+        return json.loads(m.group(0)) if m else {"raw": text[:500]}
+
+    return _score
+
+
+# === SC3: Worker pool ========================================================
+class ScoringPool:
+    def __init__(
+        self,
+        db_path: Path,
+        workers: int = 2,
+        model_scorer: Optional[Callable[[List[Any]], Dict[str, Any]]] = None,
+        poll_s: float = 2.0,
+        max_attempts: int = 3,
+    ):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.model_scorer = model_scorer
+        self.poll_s = poll_s
+        self.max_attempts = max_attempts
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._started = _now()
+        self._done = 0
+        self._errors = 0
+        self._busy_s = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.db_path), timeout=30)
+
+    # Lease habis (worker/proses mati setelah klaim) -> antre ulang, atau 'error'
+    # bila sudah mencapai max_attempts agar job yang selalu membuat crash tidak berputar
+    def recover_stale(self, conn: sqlite3.Connection) -> int:
+        cur = conn.execute(
+            "UPDATE score_job SET status=CASE WHEN attempts>=? THEN 'error' ELSE 'queued' END,"
+            "error='lease habis' WHERE status='running' AND started_at < ?",
+            (self.max_attempts, _now() - LEASE_S),
+        )
+        conn.commit()
+        return cur.rowcount
+
+    def _claim(self, conn: sqlite3.Connection) -> Optional[Tuple[str, str]]:
+        now = _now()
+        row = conn.execute(
+            "SELECT convo_id,content_hash FROM score_job WHERE status='queued' AND not_before<=? "
+            "ORDER BY not_before LIMIT 1",
+            (now,),
+        ).fetchone()
+        if not row:
+            return None
+        cur = conn.execute(
+            "UPDATE score_job SET status='running',started_at=?,attempts=attempts+1 "
+            "WHERE convo_id=? AND content_hash=? AND status='queued'",
+            (now, row[0], row[1]),
+        )
+        conn.commit()
+        return (row[0], row[1]) if cur.rowcount == 1 else None  # kalah balapan -> coba lagi
+
+    def score_one(self, conn: sqlite3.Connection, convo_id: str, chash: str) -> None:
+        from storage import load_messages
+
+        t0 = time.perf_counter()
+        try:
+            msgs = load_messages(conn, convo_id)
+            result = rule_score(msgs)
+            if self.model_scorer is not None:
+                try:
+                    result["model"] = self.model_scorer(msgs)
+                except Exception as e:  # pass model opsional; rubrik aturan tetap disimpan
+                    result["model_error"] = f"{type(e).__name__}: {e}"
+            result["scored_at"] = datetime.now().isoformat(timespec="seconds")
+            # Simpan hanya jika isi belum berubah sejak diklaim (jika berubah, job sudah diantre ulang)
+            cur = conn.execute(
+                "UPDATE score_job SET status='done',finished_at=?,error=NULL "
+                "WHERE convo_id=? AND content_hash=? AND status='running'",
+                (_now(), convo_id, chash),
+            )
+            if cur.rowcount == 1:
+                conn.execute(
+                    "UPDATE convo SET score_json=? WHERE id=?", (json.dumps(result, ensure_ascii=False), convo_id)
+                )
+            conn.commit()
+            with self._lock:
+                self._done += 1
+        except Exception as e:
+            conn.rollback()
+            conn.execute(
+                "UPDATE score_job SET status=CASE WHEN attempts>=? THEN 'error' ELSE 'queued' END,"
+                "not_before=?,error=? WHERE convo_id=? AND content_hash=?",
+                (self.max_attempts, _now() + 10.0, f"{type(e).__name__}: {e}", convo_id, chash),
+            )
+            conn.commit()
+            with self._lock:
+                self._errors += 1
+        finally:
+            with self._lock:
+                self._busy_s += time.perf_counter() - t0
+
+    def _worker(self, once: bool) -> None:
+        conn = self._connect()
+        try:
+            while not self._stop.is_set():
+                job = self._claim(conn)
+                if job is None and self.recover_stale(conn):
+                    continue  # dicek tiap poll, bukan hanya saat start()
+                if job is None:
+                    if once:
+                        return
+                    self._stop.wait(self.poll_s)
+                    continue
+                self.score_one(conn, *job)
+        finally:
+            conn.close()
+
+    def start(self, once: bool = False) -> "ScoringPool":
+        conn = self._connect()
+        try:
+            self.recover_stale(conn)
+        finally:
+            conn.close()
+        self._started = _now()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, args=(once,), name=f"scoring-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def join(self) -> None:
+        for t in self._threads:
+            t.join()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.join()
+
+    def metrics(self) -> Dict[str, Any]:
+        elapsed = max(1e-9, _now() - self._started)
+        with self._lock:
+            done, errors, busy = self._done, self._errors, self._busy_s
+        return {
+            "workers": self.workers,
+            "scored": done,
+            "errors": errors,
+            "elapsed_s": round(elapsed, 2),
+            "throughput_per_min": round(60 * done / elapsed, 1),
+            "avg_job_ms": round(1000 * busy / (done + errors), 1) if done + errors else 0.0,
+        }
+
+
+def backlog(conn: sqlite3.Connection) -> Dict[str, int]:
+    return {s: n for s, n in conn.execute("SELECT status, COUNT(*) FROM score_job GROUP BY status")}
+
+
+def pool_from_env(db_path: Path, client: Any = None, model: str = "", limiter: Any = None) -> Optional[ScoringPool]:
+    workers = int(os.getenv("SCORING_WORKERS", "1") or 0)
+    if workers <= 0:
+        return None
+    scorer = None
+    if os.getenv("SCORING_MODEL_PASS") == "1" and client is not None and model:
+        scorer = make_genai_scorer(client, model, limiter)
+    return ScoringPool(db_path, workers=workers, model_scorer=scorer)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from messages import messages_to_json
+    from storage import DB_PATH, load_messages, open_db
+
+    ap = argparse.ArgumentParser(description="Antrian penilaian role-play.")
+    ap.add_argument("command", choices=["run", "enqueue-all", "status"])
+    ap.add_argument("--db", default=str(DB_PATH))
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--once", action="store_true", help="berhenti saat antrian kosong")
+    args = ap.parse_args(argv)
+    conn = open_db(args.db)
+    if args.command == "enqueue-all":
+        for (convo_id,) in conn.execute("SELECT id FROM convo").fetchall():
+            enqueue(conn, convo_id, content_hash(messages_to_json(load_messages(conn, convo_id))), 0.0)
+        conn.commit()
+    elif args.command == "run":
+        pool = ScoringPool(Path(args.db), workers=args.workers).start(once=args.once)
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            pool.stop()
+        print(json.dumps(pool.metrics(), ensure_ascii=False))
+    print(json.dumps(backlog(conn), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+# storage.py
+# =============================================================================
+# Penyimpanan riwayat percakapan (SQLite), tanpa dependensi Streamlit.
+# Dipakai app.py, halaman dashboard, dan perintah offline (rebuild, dsb).
+# =============================================================================
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import analytics
+import scoring
+from messages import ChatMessage, messages_from_json, messages_to_json
+
+DB_PATH = Path(__file__).with_name("telesales_history.sqlite")
+
+# Satu koneksi dipakai bersama semua sesi; baca-lalu-tulis harus atomik
+_WRITE_LOCK = threading.RLock()
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def open_db(path: Optional[Path] = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path or DB_PATH), check_same_thread=False)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS convo(
+            id TEXT PRIMARY KEY,
+            title TEXT,
+            audience TEXT,
+            segment TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            messages_json TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_convo_updated ON convo(updated_at DESC)")
+    # Migrasi: ringkasan per percakapan agar analitik tidak perlu parse messages_json
+    cols = _columns(conn, "convo")
+    has_summary = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_summary'"
+    ).fetchone() is not None
+    # Baris lama belum punya turns/ringkasan: isi dari messages_json sekali di sini,
+    # agar jalur inkremental tidak mulai dari ringkasan kosong
+    backfill = "turns" not in cols or not has_summary
+    if "turns" not in cols:
+        conn.execute("ALTER TABLE convo ADD COLUMN turns INTEGER NOT NULL DEFAULT 0")
+    if "openers" not in cols:
+        conn.execute("ALTER TABLE convo ADD COLUMN openers INTEGER NOT NULL DEFAULT 0")
+    # Fork copy-on-write: baris anak hanya menyimpan pesan setelah fork_pos
+    if "parent_id" not in cols:
+        conn.execute("ALTER TABLE convo ADD COLUMN parent_id TEXT")
+    if "fork_pos" not in cols:
+        conn.execute("ALTER TABLE convo ADD COLUMN fork_pos INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_convo_parent ON convo(parent_id)")
+    analytics.ensure_schema(conn)
+    scoring.ensure_schema(conn)
+    conn.commit()
+    if backfill:
+        analytics.rebuild(conn)
+    return conn
+
+
+def _stats_row(conn: sqlite3.Connection, convo_id: str) -> Optional[Tuple[str, str, str, int, int]]:
+    return conn.execute(
+        "SELECT created_at,audience,segment,turns,openers FROM convo WHERE id=?", (convo_id,)
+    ).fetchone()
+
+
+def upsert_convo(
+    conn: sqlite3.Connection,
+    convo_id: str,
+    title: str,
+    audience: str,
+    segment: str,
+    msgs: List[ChatMessage],
+    new_openers: int = 0,
+) -> None:
+    now = datetime.now().isoformat(timespec="seconds")
+    turns = analytics.count_turns(msgs)
+    with _WRITE_LOCK:
+        old = _stats_row(conn, convo_id)
+        created_at = old[0] if old else now
+        openers = (old[4] if old else 0) + new_openers
+        link = conn.execute("SELECT parent_id,fork_pos FROM convo WHERE id=?", (convo_id,)).fetchone()
+        own = msgs[link[1]:] if link and link[0] else msgs  # prefix milik induk tidak disalin
+        try:
+            conn.execute(
+                "INSERT INTO convo(id,title,audience,segment,created_at,updated_at,messages_json,turns,openers) "
+                "VALUES(?,?,?,?,?,?,?,?,?) "
+                "ON CONFLICT(id) DO UPDATE SET "
+                "title=excluded.title,audience=excluded.audience,segment=excluded.segment,updated_at=excluded.updated_at,"
+                "messages_json=excluded.messages_json,turns=excluded.turns,openers=excluded.openers",
+                (convo_id, title, audience, segment, created_at, now, messages_to_json(own), turns, openers),
+            )
+            analytics.on_upsert(conn, old, (created_at, audience, segment, turns, openers))
+            scoring.enqueue(conn, convo_id, scoring.content_hash(messages_to_json(msgs)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def delete_convo_row(conn: sqlite3.Connection, convo_id: str) -> None:
+    with _WRITE_LOCK:
+        old = _stats_row(conn, convo_id)
+        try:
+            _reparent_children(conn, convo_id)
+            conn.execute("DELETE FROM convo WHERE id=?", (convo_id,))
+            analytics.on_delete(conn, old)
+            scoring.on_delete(conn, convo_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def list_convo_rows(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    rows = conn.execute(
+        "SELECT id,title,audience,segment,created_at,updated_at,parent_id FROM convo ORDER BY updated_at DESC"
+    ).fetchall()
+    return [
+        {
+            "id": r[0],
+            "title": r[1],
+            "audience": r[2],
+            "segment": r[3],
+            "created_at": r[4],
+            "updated_at": r[5],
+            "parent_id": r[6],
+        }
+        for r in rows
+    ]
+
+
+# === S2: Fork copy-on-write ==================================================
+MAX_FORK_DEPTH = 1000
+
+def _chain(conn: sqlite3.Connection, convo_id: str) -> List[Tuple[str, Optional[str], int, str]]:
+    # Satu query: dari daun ke akar (id, parent_id, fork_pos, messages_json)
+    return conn.execute(
+        """
+        WITH RECURSIVE chain(id,parent_id,fork_pos,messages_json,depth) AS (
+            SELECT id,parent_id,fork_pos,messages_json,0 FROM convo WHERE id=?
+            UNION ALL
+            SELECT c.id,c.parent_id,c.fork_pos,c.messages_json,chain.depth+1
+            FROM convo c JOIN chain ON c.id=chain.parent_id
+            WHERE chain.depth < ?
+        )
+        SELECT id,parent_id,fork_pos,messages_json FROM chain ORDER BY depth
+        """,
+        (convo_id, MAX_FORK_DEPTH),
+    ).fetchall()
+
+
+def load_messages(conn: sqlite3.Connection, convo_id: str) -> List[ChatMessage]:
+    # Dari daun ke akar: tiap level hanya menyumbang bagian yang benar-benar dipakai
+    segments: List[List[ChatMessage]] = []
+    need: Optional[int] = None  # jumlah pesan yang dibutuhkan dari level ini (None = semua)
+    for _id, parent_id, fork_pos, raw in _chain(conn, convo_id):
+        base = fork_pos if parent_id else 0
+        own = messages_from_json(raw)
+        if need is not None:
+            own = own[:max(0, need - base)]
+        segments.append(own)
+        need = base if need is None else min(need, base)
+        if not need:
+            break
+    out: List[ChatMessage] = []
+    for seg in reversed(segments):
+        out.extend(seg)
+    return out
+
+
+def load_convo_data(conn: sqlite3.Connection, convo_id: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute(
+        "SELECT audience,segment,title,parent_id,fork_pos FROM convo WHERE id=?", (convo_id,)
+    ).fetchone()
+    if not row:
+        return None
+    return {
+        "messages": load_messages(conn, convo_id),
+        "audience": row[0],
+        "segment": row[1],
+        "title": row[2],
+        "parent_id": row[3],
+        "fork_pos": row[4],
+    }
+
+
+def fork_convo(conn: sqlite3.Connection, parent_id: str, position: int, title: Optional[str] = None) -> str:
+    with _WRITE_LOCK:
+        parent = conn.execute("SELECT audience,segment,title FROM convo WHERE id=?", (parent_id,)).fetchone()
+        if not parent:
+            raise KeyError(parent_id)
+        prefix = load_messages(conn, parent_id)
+        if not 0 < position <= len(prefix):
+            raise ValueError(f"posisi fork harus 1..{len(prefix)}")
+        new_id = uuid.uuid4().hex
+        now = datetime.now().isoformat(timespec="seconds")
+        turns = analytics.count_turns(prefix[:position])
+        try:
+            conn.execute(
+                "INSERT INTO convo(id,title,audience,segment,created_at,updated_at,messages_json,turns,openers,parent_id,fork_pos) "
+                "VALUES(?,?,?,?,?,?,?,?,?,?,?)",
+                (
+                    new_id, title or f"{parent[2] or 'Percakapan'} (fork @{position})",
+                    parent[0], parent[1], now, now, "[]", turns, 0, parent_id, position,
+                ),
+            )
+            analytics.on_upsert(conn, None, (now, parent[0], parent[1], turns, 0))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return new_id
+
+
+def _reparent_children(conn: sqlite3.Connection, convo_id: str) -> None:
+    # Induk dihapus: anak dipindah ke kakek dengan menyalin hanya potongan milik induk
+    # yang dipakai anak, sehingga rantai tetap copy-on-write.
+    row = conn.execute("SELECT parent_id,fork_pos,messages_json FROM convo WHERE id=?", (convo_id,)).fetchone()
+    if not row:
+        return
+    grand, p_pos, p_raw = row[0], (row[1] if row[0] else 0), row[2]
+    p_own: Optional[List[ChatMessage]] = None
+    for child_id, c_pos, c_raw in conn.execute(
+        "SELECT id,fork_pos,messages_json FROM convo WHERE parent_id=?", (convo_id,)
+    ).fetchall():
+        if c_pos <= p_pos:
+            conn.execute("UPDATE convo SET parent_id=?, fork_pos=? WHERE id=?", (grand, c_pos, child_id))
+            continue
+        if p_own is None:
+            p_own = messages_from_json(p_raw)
+        own = p_own[:c_pos - p_pos] + messages_from_json(c_raw)
+        conn.execute(
+            "UPDATE convo SET parent_id=?, fork_pos=?, messages_json=? WHERE id=?",
+            (grand, p_pos if grand else 0, messages_to_json(own), child_id),
+        )
+
+
+# === S3: Benchmark rantai fork ===============================================
+def _bench_fork_chain(depths: Tuple[int, ...] = (1, 10, 50, 200), turns_per_fork: int = 4, base_len: int = 40) -> None:
+    import os
+    import tempfile
+    import time
+
+    for depth in depths:
+        fd, path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        conn = open_db(Path(path))
+        msgs = [ChatMessage("user" if i % 2 == 0 else "assistant", f"pesan dasar {i} " * 8) for i in range(base_len)]
+        upsert_convo(conn, "root", "root", "Murid", "SMP", msgs)
+        leaf = "root"
+        for d in range(depth):
+            # fork di tengah giliran baru induk, lalu tambahkan giliran yang menyimpang
+            pos = len(msgs) - turns_per_fork // 2 if d else len(msgs) // 2
+            leaf = fork_convo(conn, leaf, pos)
+            msgs = msgs[:pos] + [ChatMessage("user", f"fork {d} giliran {t} " * 8) for t in range(turns_per_fork)]
+            upsert_convo(conn, leaf, f"fork {d}", "Murid", "SMP", msgs)
+        stored = conn.execute("SELECT SUM(LENGTH(messages_json)) FROM convo").fetchone()[0]
+        full_copy = len(messages_to_json(msgs)) * (depth + 1)  # perkiraan jika tiap fork menyalin penuh
+        runs = 50
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            loaded = load_messages(conn, leaf)
+        ms = (time.perf_counter() - t0) / runs * 1000
+        assert [m.content for m in loaded] == [m.content for m in msgs]
+        print(f"depth={depth:>4}  pesan={len(msgs):>4}  load={ms:7.3f} ms  "
+              f"simpan={stored / 1024:8.1f} KiB  (salin penuh ~{full_copy / 1024:8.1f} KiB)")
+        conn.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    _bench_fork_chain()
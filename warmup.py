@@ -0,0 +1,215 @@
+# warmup.py
+# =============================================================================
+# Pemanasan jalur balasan selagi trainee mengetik (opsional, GENAI_WARMUP=1).
+# - ConnectionWarmer: satu per replika; ping ringan (mis. models.get) lewat client
+#   bersama agar koneksi HTTP di pool-nya sudah terbuka dan tetap hidup selama
+#   ada sesi aktif. Berhenti sendiri bila tidak ada sesi aktif selama idle_ttl.
+# - Prompt disiapkan lewat prompts.PreparedDialog (lihat app.py).
+#
+#   python warmup.py [--requests 20] [--handshake-ms 60]
+# menjalankan benchmark TTFT warm-up on/off terhadap server tiruan lokal.
+# =============================================================================
+import os
+import sys
+import time
+import argparse
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from ratelimit import env_float
+
+
+class ConnectionWarmer:
+    def __init__(self, ping: Callable[[], Any], interval_s: float = 45.0, idle_ttl_s: float = 300.0):
+        # interval_s di bawah idle timeout keep-alive server/proxy pada umumnya (~60 s)
+        self.ping = ping
+        self.interval_s = interval_s
+        self.idle_ttl_s = idle_ttl_s
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._last_active = 0.0
+        self._pings = 0
+        self._failures = 0
+        self._last_ping_ms = 0.0
+
+    # Dipanggil tiap rerun sesi: tandai aktif dan pastikan thread keep-alive berjalan
+    def touch(self) -> None:
+        with self._lock:
+            self._last_active = time.monotonic()
+            if self._stopped or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name="genai-warmup", daemon=True)
+            self._thread.start()
+
+    def _ping_once(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            self.ping()
+            ok = True
+        except Exception:
+            ok = False
+        with self._lock:
+            self._pings += 1
+            self._failures += 0 if ok else 1
+            self._last_ping_ms = (time.perf_counter() - t0) * 1000
+
+    def _run(self) -> None:
+        while True:
+            self._ping_once()
+            self._wake.wait(self.interval_s)
+            with self._lock:
+                idle = time.monotonic() - self._last_active > self.idle_ttl_s
+                if self._stopped or idle:
+                    self._thread = None
+                    return
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stopped = True
+        self._wake.set()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": self._thread is not None and self._thread.is_alive(),
+                "pings": self._pings,
+                "failures": self._failures,
+                "last_ping_ms": round(self._last_ping_ms, 1),
+            }
+
+
+def warmer_from_env(ping: Callable[[], Any]) -> Optional[ConnectionWarmer]:
+    if os.getenv("GENAI_WARMUP") != "1":
+        return None
+    return ConnectionWarmer(
+        ping,
+        interval_s=env_float("GENAI_WARMUP_INTERVAL", 45.0),
+        idle_ttl_s=env_float("GENAI_WARMUP_IDLE_TTL", 300.0),
+    )
+
+
+# === W1: Benchmark TTFT terhadap server tiruan lokal ==========================
+# Server tiruan: setiap koneksi BARU dikenai jeda handshake_ms (mewakili TCP+TLS ke
+# endpoint model), lalu respons streaming chunked dengan token pertama setelah think_ms.
+# Koneksi idle ditutup server setelah idle_s, seperti keep-alive timeout sungguhan.
+def _start_stub(handshake_ms: float, think_ms: float, idle_s: float):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        timeout = idle_s
+
+        def setup(self) -> None:
+            super().setup()
+            time.sleep(handshake_ms / 1000)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def do_GET(self) -> None:  # ping ringan (setara models.get)
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(think_ms / 1000)
+            for piece in (b"Halo, ", b"saya ", b"mau ", b"cerita dulu."):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+                self.wfile.flush()
+                time.sleep(0.005)
+            self.wfile.write(b"0\r\n\r\n")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _post_first_token(conn: Any, prompt: str) -> float:
+    # Kembalikan waktu (perf_counter) saat potongan pertama diterima; sisa stream dibaca habis
+    conn.request("POST", "/stream", body=prompt.encode("utf-8"), headers={"Content-Type": "text/plain"})
+    resp = conn.getresponse()
+    resp.read1(64)
+    t_first = time.perf_counter()
+    resp.read()
+    return t_first
+
+
+def _pct(xs: List[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+def _bench(requests: int = 20, handshake_ms: float = 60.0, think_ms: float = 40.0,
+           typing_s: float = 0.4, idle_s: float = 0.25) -> None:
+    import http.client
+
+    from messages import ChatMessage
+    from prompt_budget import sample_history
+    from prompts import PreparedDialog, build_prompt
+
+    server = _start_stub(handshake_ms, think_ms, idle_s)
+    host, port = server.server_address[:2]
+    history = sample_history(24)
+    user_line = "Kira-kira anaknya paling kesulitan di bagian mana, Bu?"
+    results: Dict[str, List[float]] = {"off": [], "on": []}
+
+    # off: koneksi baru dan prompt dibangun penuh setelah submit
+    for _ in range(requests):
+        time.sleep(typing_s)
+        t0 = time.perf_counter()
+        prompt = build_prompt(history + [ChatMessage("user", user_line)], "Orang Tua", "SMP")
+        conn = http.client.HTTPConnection(host, port)
+        results["off"].append((_post_first_token(conn, prompt) - t0) * 1000)
+        conn.close()
+
+    # on: koneksi dijaga hidup oleh ConnectionWarmer, prompt disiapkan selagi "mengetik"
+    conn = http.client.HTTPConnection(host, port)
+    conn_lock = threading.Lock()
+
+    def _ping() -> None:
+        with conn_lock:
+            conn.request("GET", "/ping")
+            conn.getresponse().read()
+
+    warmer = ConnectionWarmer(_ping, interval_s=idle_s / 2, idle_ttl_s=60.0)
+    for _ in range(requests):
+        warmer.touch()
+        prepared = PreparedDialog(history, "Orang Tua", "SMP")
+        time.sleep(typing_s)
+        with conn_lock:
+            t0 = time.perf_counter()
+            prompt = prepared.finish(user_line)
+            results["on"].append((_post_first_token(conn, prompt) - t0) * 1000)
+    warmer.stop()
+    conn.close()
+    server.shutdown()
+
+    print(f"server tiruan: handshake {handshake_ms:.0f} ms, token pertama {think_ms:.0f} ms, "
+          f"idle timeout {idle_s * 1000:.0f} ms, jeda mengetik {typing_s * 1000:.0f} ms")
+    for name in ("off", "on"):
+        xs = results[name]
+        print(f"warm-up {name:<3}  TTFT p50={_pct(xs, 0.5):7.1f} ms  p95={_pct(xs, 0.95):7.1f} ms  (n={len(xs)})")
+    print(f"ping keep-alive: {warmer.metrics()}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark TTFT warm-up on/off terhadap server tiruan lokal.")
+    ap.add_argument("--requests", type=int, default=20)
+    ap.add_argument("--handshake-ms", type=float, default=60.0)
+    ap.add_argument("--think-ms", type=float, default=40.0)
+    ap.add_argument("--typing-s", type=float, default=0.4)
+    args = ap.parse_args(argv)
+    _bench(args.requests, args.handshake_ms, args.think_ms, args.typing_s)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())